@@ -0,0 +1,197 @@
+# I pledge my honor that I've abided by the Stevens Honor System
+# Steven DeFalco
+# Lucas Hope
+import os
+import sys
+import random
+import timeit
+import warnings
+import tempfile
+import contextlib
+import subprocess
+from esql import parse_query, parse_condition, QuerySyntaxError
+
+'''
+Benchmarks and checks for the query engine, run with:
+    python benchmark.py parse            time parsing every query in the 'queries' directory
+    python benchmark.py fuzz [count]     parse mutated queries and σ conditions, only input errors may be raised
+    python benchmark.py imports          check the cold start import time of generator.py against its budget
+'''
+
+QUERY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "queries")
+
+# columns of the sales table and their datatype OIDs, for checking conditions without a database
+SALES_COLUMNS = {'cust': 1043, 'prod': 1043, 'day': 23, 'month': 23, 'year': 23,
+                 'state': 1042, 'quant': 23, 'date': 1082}
+
+# conditions that exercise what the corpus does not: and/or/not, arithmetic, exponents and unbalanced quotes
+CONDITION_SEEDS = [
+    "1.quant>500 or quant<10",
+    "1.state='NY' and quant>500",
+    "2.not (state='NY' or state = \"NJ\") and date >= '2018/01/01'",
+    "3.quant * 2 - year % 4 > 1e2 and cust < 'Emily'",
+    "1.state='PA",
+    "2.date='2016-02-29' or month <> -3",
+]
+
+# cold start budget for importing generator.py, and the modules that should only load when they are needed
+IMPORT_BUDGET_MS = 50
+LAZY_MODULES = ['psycopg2', 'dotenv', 'tabulate']
+
+
+def read_queries():
+    queries = {}
+    for filename in sorted(os.listdir(QUERY_DIR)):
+        with open(os.path.join(QUERY_DIR, filename), 'r') as f:
+            queries[filename] = f.read()
+    return queries
+
+
+def bench_parse(number=2000):
+    """Prints the average time to parse each query file"""
+    print(f"{'query':<30}{'us/parse':>10}")
+    for filename, text in read_queries().items():
+        def parse():
+            try:
+                parse_query(text)
+            except QuerySyntaxError:
+                pass
+        seconds = timeit.timeit(parse, number=number)
+        print(f"{filename:<30}{seconds / number * 1e6:>10.1f}")
+
+
+def mutate(text, rng):
+    """Randomly deletes, duplicates, swaps or truncates part of a query"""
+    if not text:
+        return text
+    choice = rng.randrange(4)
+    i = rng.randrange(len(text))
+    if choice == 0:
+        return text[:i] + text[i + 1:]
+    if choice == 1:
+        return text[:i] + text[i] + text[i:]
+    if choice == 2:
+        j = rng.randrange(len(text))
+        chars = list(text)
+        chars[i], chars[j] = chars[j], chars[i]
+        return ''.join(chars)
+    return text[:i]
+
+
+def fuzz(count=10000, seed=0):
+    """Parses mutated queries from the corpus, anything other than a QuerySyntaxError is a bug"""
+    rng = random.Random(seed)
+    corpus = list(read_queries().values())
+    failures = 0
+    for _ in range(count):
+        text = rng.choice(corpus)
+        for _ in range(rng.randint(1, 5)):
+            text = mutate(text, rng)
+        try:
+            parse_query(text)
+        except QuerySyntaxError:
+            pass
+        except Exception as error:
+            failures += 1
+            print(f"{type(error).__name__}: {error}\n{text}\n")
+    print(f"{count} mutated queries parsed, {failures} unexpected errors")
+    return failures
+
+
+def fuzz_conditions(count=10000, seed=0):
+    """Checks mutated σ conditions with parse_condition and PhiOperator.process_mf_struct.
+
+    parse_condition may only raise QuerySyntaxError, process_mf_struct may only drop conditions
+    (or exit on another input error), and every condition it keeps must parse for a valid grouping variable.
+    """
+    from phi import PhiOperator
+
+    rng = random.Random(seed)
+    corpus = list(CONDITION_SEEDS)
+    for text in read_queries().values():
+        try:
+            corpus.extend(parse_query(text)['sigma'])
+        except QuerySyntaxError:
+            pass
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'fuzz.txt')
+        for _ in range(count):
+            cond = rng.choice(corpus)
+            for _ in range(rng.randint(1, 3)):
+                cond = mutate(cond, rng)
+            if '\n' in cond:
+                continue
+            try:
+                try:
+                    parse_condition(cond)
+                except QuerySyntaxError:
+                    pass
+                with open(path, 'w') as f:
+                    f.write("SELECT ATTRIBUTE(S):\ncust, 1_sum_quant\nNUMBER OF GROUPING VARIABLES(n):\n3\n"
+                            "GROUPING ATTRIBUTES(V):\ncust\nF-VECT([F]):\n1_sum_quant\n"
+                            f"SELECT CONDITION-VECT([σ]):\n{cond}\nHAVING_CONDITION(G):\n")
+                # dropped conditions warn and other input errors print and exit, both are expected
+                with warnings.catch_warnings(), contextlib.redirect_stdout(None):
+                    warnings.simplefilter('ignore')
+                    try:
+                        processing = PhiOperator(path)
+                        processing.process_mf_struct(list(SALES_COLUMNS), SALES_COLUMNS)
+                    except SystemExit:
+                        continue
+                for kept in processing.mf_struct['sigma']:
+                    group, _ = parse_condition(kept)
+                    if group not in range(1, 4):
+                        raise ValueError(f"Kept a condition for grouping variable {group}: {kept}")
+            except Exception as error:
+                failures += 1
+                print(f"{type(error).__name__}: {error}\n{cond}\n")
+    print(f"{count} mutated conditions checked, {failures} unexpected errors")
+    return failures
+
+
+def bench_imports(runs=5):
+    """Imports generator.py in fresh interpreters with -X importtime, prints the slowest modules
+    and returns False if the best cold start is over budget or a lazy module was imported"""
+    best = None
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import generator"],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            print(result.stderr.splitlines()[-1])
+            return False
+        # lines look like: import time: self [us] | cumulative | imported package
+        modules = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line[len("import time:"):].split('|')
+            modules[name.strip()] = int(cumulative)
+        if best is None or modules.get('generator', 0) < best.get('generator', 0):
+            best = modules
+
+    total_ms = best.get('generator', 0) / 1000
+    for name, cumulative in sorted(best.items(), key=lambda item: -item[1])[:10]:
+        print(f"{name:<30}{cumulative / 1000:>8.2f} ms")
+    print(f"cold start: {total_ms:.2f} ms (budget {IMPORT_BUDGET_MS} ms)")
+
+    ok = total_ms <= IMPORT_BUDGET_MS
+    for name in best:
+        if name.split('.')[0] in LAZY_MODULES:
+            print(f"{name} is imported at startup, it should be imported when it is needed")
+            ok = False
+    return ok
+
+
+if "__main__" == __name__:
+    command = sys.argv[1] if len(sys.argv) > 1 else 'parse'
+    if command == 'parse':
+        bench_parse()
+    elif command == 'imports':
+        sys.exit(0 if bench_imports() else 1)
+    elif command == 'fuzz':
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+        sys.exit(1 if fuzz(count) + fuzz_conditions(count) else 0)
+    else:
+        print(f"Unknown benchmark: {command}")
+        sys.exit(1)
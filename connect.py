@@ -2,16 +2,52 @@
 # Steven DeFalco
 # Lucas Hope
 import os
-import psycopg2
-import psycopg2.extras
-from dotenv import load_dotenv
 
+# OIDs for datatypes in postgreSQL
+DATE_OID = 1082
+STRING_OIDs = [25, 1042, 1043]
+NUMERICAL_OIDs = [21, 23, 20, 1700, 700, 701]
 
-def get_database():
+# string columns with at most this many distinct values per row are dictionary-encoded
+LOW_CARDINALITY = 0.5
+
+
+def encode_rows(rows, column_names, column_datatypes, low_cardinality=LOW_CARDINALITY):
     """
-    Used for testing standard queries in SQL.
+    Turns fetched rows into compact tuples of numbers. Dates become ordinals and low-cardinality
+    string columns become indexes into a sorted dictionary of their values, so codes compare in
+    the same order as the strings. Returns the rows and the dictionaries ({column: [values]}).
     """
-    load_dotenv()
+    columns = [list(column) for column in zip(*rows)] if rows else [[] for _ in column_names]
+    dictionaries = {}
+    for i, name in enumerate(column_names):
+        if column_datatypes[name] == DATE_OID:
+            columns[i] = [None if value is None else value.toordinal() for value in columns[i]]
+        elif column_datatypes[name] in STRING_OIDs:
+            values = set(columns[i])
+            if None in values or len(values) > low_cardinality * len(rows):
+                continue
+            values = sorted(values)
+            codes = {value: code for code, value in enumerate(values)}
+            columns[i] = [codes[value] for value in columns[i]]
+            dictionaries[name] = values
+    return list(zip(*columns)), dictionaries
+
+
+def describe(cur):
+    """Returns the column names and {column: datatype OID} of the last query on cur"""
+    column_names = [desc[0] for desc in cur.description]
+    datatypes = [desc[1] for desc in cur.description]
+
+    column_datatypes = {}
+    for i in range(0, len(column_names)):
+        column_datatypes[column_names[i]] = datatypes[i]
+    return column_names, column_datatypes
+
+
+def connect_database():
+    """Connects to the database given in .env"""
+    import psycopg2
 
     host= os.getenv('HOST')
     user = os.getenv('USERNAME')
@@ -19,16 +55,111 @@ def get_database():
     dbname = os.getenv('DBNAME') 
     port = os.getenv('PORT')
 
-    conn = psycopg2.connect(host=host, dbname=dbname, user=user, password=password, 
-                            port=port, cursor_factory=psycopg2.extras.DictCursor)
+    return psycopg2.connect(host=host, dbname=dbname, user=user, password=password, port=port)
+
+
+def get_database():
+    """
+    Used for testing standard queries in SQL.
+    Returns the rows (see encode_rows), the column names, their datatype OIDs and the string dictionaries.
+
+    When SNAPSHOT is set to a file path in .env, the table is kept in that local snapshot. It is used without
+    contacting the database for SNAPSHOT_TTL seconds, and after that as long as the row count is unchanged.
+    """
+    # imported here so starting the CLI does not pay for the database driver until it connects
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    snapshot_path = os.getenv('SNAPSHOT')
+    snapshot = None
+    if snapshot_path:
+        from snapshot import open_snapshot
+        snapshot = open_snapshot(snapshot_path)
+        try:
+            ttl = float(os.getenv('SNAPSHOT_TTL') or 0)
+        except ValueError:
+            # a malformed TTL falls back to checking the row count on every run
+            ttl = 0
+        if snapshot is not None and snapshot.age() < ttl:
+            return snapshot.rows(), snapshot.column_names, snapshot.column_datatypes, snapshot.dictionaries
+
+    # the default cursor returns plain tuples, the engine only indexes rows through column_names
+    conn = connect_database()
     cur = conn.cursor()
+
+    # an expired snapshot is still fresh if the table has the same number of rows
+    if snapshot is not None:
+        cur.execute("SELECT count(*) FROM sales")
+        if cur.fetchone()[0] == snapshot.row_count:
+            snapshot.touch()
+            return snapshot.rows(), snapshot.column_names, snapshot.column_datatypes, snapshot.dictionaries
+
     cur.execute("SELECT * FROM sales")
-    column_names = [desc[0] for desc in cur.description]
-    datatypes = [desc[1] for desc in cur.description]
+    column_names, column_datatypes = describe(cur)
 
-    column_datatypes = {}
-    for i in range(0, len(column_names)):
-        column_datatypes[column_names[i]] = datatypes[i]
+    if snapshot_path:
+        # every string column is dictionary-encoded so that all columns fit the snapshot's fixed-width arrays
+        from snapshot import write_snapshot
+        rows, dictionaries = encode_rows(cur.fetchall(), column_names, column_datatypes, low_cardinality=1)
+        if not write_snapshot(snapshot_path, rows, column_names, column_datatypes, dictionaries):
+            print(f"Snapshot {snapshot_path} not written: the table has values it cannot store (e.g. NUMERIC or NULL)")
+    else:
+        rows, dictionaries = encode_rows(cur.fetchall(), column_names, column_datatypes)
+    return rows, column_names, column_datatypes, dictionaries
+
+
+def get_statistics(sample_size=1000):
+    """
+    Used by EXPLAIN to plan a query without fetching the table.
+    Returns a sample of the rows (see encode_rows), the column names, their datatype OIDs, the sample's
+    string dictionaries and the statistics {'rows': row count, 'n_distinct': {column: distinct values},
+    'indexes': [index definitions], 'minimums': {numerical column: smallest value}}.
+
+    The row count and distinct values are the planner statistics in pg_class and pg_stats, which ANALYZE
+    keeps up to date, and the sample comes from TABLESAMPLE, so only about sample_size rows are read.
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    conn = connect_database()
+    cur = conn.cursor()
+
+    cur.execute("SELECT reltuples FROM pg_class WHERE relname = 'sales' AND relkind = 'r'")
+    result = cur.fetchone()
+    row_count = round(result[0]) if result else -1
+    # -1 (0 before postgreSQL 14) when the table was never analyzed
+    if row_count <= 0:
+        cur.execute("SELECT count(*) FROM sales")
+        row_count = cur.fetchone()[0]
+
+    cur.execute("SELECT attname, n_distinct FROM pg_stats WHERE tablename = 'sales'")
+    n_distinct = {}
+    for name, distinct in cur.fetchall():
+        # a negative n_distinct is minus the fraction of rows, for columns whose distinct values grow with the table
+        n_distinct[name] = round(-distinct * row_count) if distinct < 0 else round(distinct)
+
+    cur.execute("SELECT indexdef FROM pg_indexes WHERE tablename = 'sales'")
+    indexes = [definition for definition, in cur.fetchall()]
+
+    # SYSTEM samples whole pages, so it reads about sample_size rows instead of scanning the table
+    percent = min(100, 100 * sample_size / row_count) if row_count else 100
+    cur.execute(f"SELECT * FROM sales TABLESAMPLE SYSTEM ({percent}) LIMIT {sample_size}")
+    sample = cur.fetchall()
+    if not sample and row_count:
+        cur.execute(f"SELECT * FROM sales LIMIT {sample_size}")
+        sample = cur.fetchall()
+    column_names, column_datatypes = describe(cur)
 
+    # exact minimums (not the sample's) decide whether a sum can only grow, which the plan's pruning relies on
+    numerical = [name for name in column_names if column_datatypes[name] in NUMERICAL_OIDs]
+    minimums = {}
+    if numerical:
+        columns = ', '.join('min("' + name.replace('"', '""') + '")' for name in numerical)
+        cur.execute(f"SELECT {columns} FROM sales")
+        minimums = dict(zip(numerical, cur.fetchone()))
+    conn.close()
 
-    return cur.fetchall(), column_names, column_datatypes
+    rows, dictionaries = encode_rows(sample, column_names, column_datatypes)
+    statistics = {'rows': row_count, 'n_distinct': n_distinct, 'indexes': indexes, 'minimums': minimums}
+    return rows, column_names, column_datatypes, dictionaries, statistics
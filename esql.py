@@ -0,0 +1,302 @@
+# I pledge my honor that I've abided by the Stevens Honor System
+# Steven DeFalco
+# Lucas Hope
+import re
+from collections import namedtuple
+
+'''
+Tokenizer and parser for query files and for the expressions in the
+conditions vector (σ) and the having clause (G).
+
+Expression grammar (lowest to highest precedence):
+    or_expr    := and_expr ('or' and_expr)*
+    and_expr   := not_expr ('and' not_expr)*
+    not_expr   := 'not' not_expr | comparison
+    comparison := sum (('=' | '==' | '!=' | '<>' | '<' | '<=' | '>' | '>=') sum)?
+    sum        := term (('+' | '-') term)*
+    term       := factor (('*' | '/' | '//' | '%') factor)*
+    factor     := ('-' | '+') factor | power
+    power      := atom ('**' factor)?
+    atom       := NUMBER | STRING | NAME | '(' or_expr ')'
+'''
+
+# Section headers of a query file, in order, with the key they fill in the mf_struct
+SECTIONS = [
+    ("SELECT ATTRIBUTE", 'S', 'SELECT ATTRIBUTE(S)'),
+    ("NUMBER OF GROUPING", 'n', 'NUMBER OF GROUPING VARIABLES(n)'),
+    ("GROUPING ATTRIBUTES", 'V', 'GROUPING ATTRIBUTES(V)'),
+    ("F-VECT", 'F', 'F-VECT([F])'),
+    ("SELECT CONDITION", 'sigma', 'SELECT CONDITION-VECT([σ])'),
+    ("HAVING", 'G', 'HAVING_CONDITION(G)'),
+]
+
+KEYWORDS = ['and', 'or', 'not']
+COMPARISONS = {'=': '==', '==': '==', '!=': '!=', '<>': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+
+Token = namedtuple('Token', ['kind', 'value', 'column'])
+
+# AST nodes
+Name = namedtuple('Name', ['id'])
+Literal = namedtuple('Literal', ['value'])
+UnaryOp = namedtuple('UnaryOp', ['op', 'operand'])
+BinOp = namedtuple('BinOp', ['op', 'left', 'right'])
+Compare = namedtuple('Compare', ['op', 'left', 'right'])
+BoolOp = namedtuple('BoolOp', ['op', 'values'])
+
+TOKEN_PATTERN = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?(?![A-Za-z0-9_]))
+  | (?P<name>\d*[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<string>'[^']*'|"[^"]*")
+  | (?P<op>\*\*|//|==|!=|<>|<=|>=|[-+*/%<>=()])
+''', re.VERBOSE)
+
+
+class QuerySyntaxError(Exception):
+    '''Exception for query files and expressions that cannot be parsed'''
+    def __init__(self, phi_component, message, line=None, column=None):
+        self.phi_component = phi_component
+        self.message = message
+        self.line = line
+        self.column = column
+        location = ""
+        if line is not None:
+            location += f" (line {line}"
+            location += f", column {column})" if column is not None else ")"
+        super().__init__("SYNTAX ERROR: " + self.phi_component + location + " - " + self.message)
+
+
+def tokenize(text, phi_component='EXPRESSION', line=None):
+    '''Splits an expression into tokens, columns are 1-based offsets into text'''
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = TOKEN_PATTERN.match(text, pos)
+        if match is None:
+            if text[pos] in "'\"":
+                message = f"Unterminated string starting with {text[pos]}"
+            else:
+                message = f"Unexpected character {text[pos]!r}"
+            raise QuerySyntaxError(phi_component, message, line, pos + 1)
+        kind = match.lastgroup
+        value = match.group()
+        if kind == 'name' and value.lower() in KEYWORDS:
+            kind, value = 'keyword', value.lower()
+        if kind != 'space':
+            tokens.append(Token(kind, value, pos + 1))
+        pos = match.end()
+    tokens.append(Token('end', '', len(text) + 1))
+    return tokens
+
+
+class ExpressionParser:
+    '''Recursive descent parser for the expression grammar'''
+    def __init__(self, text, phi_component='EXPRESSION', line=None):
+        self.phi_component = phi_component
+        self.line = line
+        self.tokens = tokenize(text, phi_component, line)
+        self.pos = 0
+
+    def parse(self):
+        node = self.or_expr()
+        if self.peek().kind != 'end':
+            self.error(f"Unexpected {self.peek().value!r}")
+        return node
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+    def advance(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def accept(self, kind, *values):
+        token = self.peek()
+        if token.kind == kind and (not values or token.value in values):
+            return self.advance()
+        return None
+
+    def error(self, message):
+        token = self.peek()
+        if token.kind == 'end':
+            message = message if token.value else "Unexpected end of expression"
+        raise QuerySyntaxError(self.phi_component, message, self.line, token.column)
+
+    def or_expr(self):
+        values = [self.and_expr()]
+        while self.accept('keyword', 'or'):
+            values.append(self.and_expr())
+        return values[0] if len(values) == 1 else BoolOp('or', values)
+
+    def and_expr(self):
+        values = [self.not_expr()]
+        while self.accept('keyword', 'and'):
+            values.append(self.not_expr())
+        return values[0] if len(values) == 1 else BoolOp('and', values)
+
+    def not_expr(self):
+        if self.accept('keyword', 'not'):
+            return UnaryOp('not', self.not_expr())
+        return self.comparison()
+
+    def comparison(self):
+        left = self.sum()
+        token = self.accept('op', *COMPARISONS)
+        if token is None:
+            return left
+        return Compare(COMPARISONS[token.value], left, self.sum())
+
+    def sum(self):
+        node = self.term()
+        while True:
+            token = self.accept('op', '+', '-')
+            if token is None:
+                return node
+            node = BinOp(token.value, node, self.term())
+
+    def term(self):
+        node = self.factor()
+        while True:
+            token = self.accept('op', '*', '/', '//', '%')
+            if token is None:
+                return node
+            node = BinOp(token.value, node, self.factor())
+
+    def factor(self):
+        token = self.accept('op', '+', '-')
+        if token is not None:
+            return UnaryOp(token.value, self.factor())
+        return self.power()
+
+    def power(self):
+        node = self.atom()
+        if self.accept('op', '**'):
+            return BinOp('**', node, self.factor())
+        return node
+
+    def atom(self):
+        token = self.peek()
+        if token.kind == 'number':
+            self.advance()
+            value = int(token.value) if token.value.isdigit() else float(token.value)
+            return Literal(value)
+        if token.kind == 'string':
+            self.advance()
+            return Literal(token.value[1:-1])
+        if token.kind == 'name':
+            self.advance()
+            return Name(token.value)
+        if self.accept('op', '('):
+            node = self.or_expr()
+            if not self.accept('op', ')'):
+                self.error("Expected ')'")
+            return node
+        self.error("Expected a number, string, attribute or aggregate")
+
+
+def parse_expression(text, phi_component='EXPRESSION', line=None):
+    '''Parses an expression (e.g. a having clause) into an AST'''
+    return ExpressionParser(text, phi_component, line).parse()
+
+
+def parse_condition(text, line=None):
+    '''Parses a condition such as 1.state='NY' into (grouping variable, AST)'''
+    phi_component = 'SELECT CONDITION-VECT([σ])'
+    match = re.match(r'\s*(\d+)\s*\.', text)
+    if match is None:
+        raise QuerySyntaxError(phi_component, "Conditions must start with a grouping variable, e.g. 1.state='NY'", line, 1)
+    # pad so that columns in errors still line up with the original text
+    node = parse_expression(' ' * match.end() + text[match.end():], phi_component, line)
+    return int(match.group(1)), node
+
+
+def names(node):
+    '''Returns the attribute and aggregate names used in an AST, in order of appearance'''
+    if isinstance(node, Name):
+        return [node.id]
+    if isinstance(node, Literal):
+        return []
+    if isinstance(node, UnaryOp):
+        return names(node.operand)
+    if isinstance(node, (BinOp, Compare)):
+        return names(node.left) + names(node.right)
+    return [name for value in node.values for name in names(value)]
+
+
+def to_python(node, resolve):
+    '''Renders an AST as Python source, resolve maps a name to the source for its value'''
+    if isinstance(node, Name):
+        return resolve(node.id)
+    if isinstance(node, Literal):
+        return repr(node.value)
+    if isinstance(node, UnaryOp):
+        separator = ' ' if node.op == 'not' else ''
+        return f"({node.op}{separator}{to_python(node.operand, resolve)})"
+    if isinstance(node, (BinOp, Compare)):
+        return f"({to_python(node.left, resolve)} {node.op} {to_python(node.right, resolve)})"
+    return '(' + f" {node.op} ".join(to_python(value, resolve) for value in node.values) + ')'
+
+
+def unparse(node):
+    '''Renders an AST back into query text with spaces between every token'''
+    def quote(value):
+        return "'" + value + "'" if "'" not in value else '"' + value + '"'
+    if isinstance(node, Name):
+        return node.id
+    if isinstance(node, Literal):
+        return quote(node.value) if isinstance(node.value, str) else repr(node.value)
+    if isinstance(node, UnaryOp):
+        return f"{node.op} {unparse(node.operand)}"
+    if isinstance(node, (BinOp, Compare)):
+        return f"( {unparse(node.left)} {node.op} {unparse(node.right)} )"
+    return '( ' + f" {node.op} ".join(unparse(value) for value in node.values) + ' )'
+
+
+def parse_query(text):
+    '''Parses the text of a query file into the raw mf_struct.
+
+    Sections are found by their headers, and the body of a section is every line until the next header.
+    S, V and F are comma-separated lists, n is a single value (0 when empty), sigma has one condition per line
+    and G is a list with the having clause (empty when there is no having clause).
+    '''
+    bodies = {}
+    current = None
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        header = next((section for section in SECTIONS if line.lstrip().startswith(section[0])), None)
+        if header is not None:
+            if header[1] in bodies:
+                raise QuerySyntaxError(header[2], "Section appears more than once", line_number)
+            current = header
+            bodies[header[1]] = []
+            continue
+        if current is None:
+            if line.strip():
+                raise QuerySyntaxError(SECTIONS[0][2], "Expected a section header before any input", line_number, 1)
+            continue
+        if line.strip():
+            bodies[current[1]].append((line_number, line.strip()))
+
+    missing = [section[2] for section in SECTIONS if section[1] not in bodies]
+    if missing:
+        raise QuerySyntaxError(missing[0], "Missing section(s): " + ', '.join(missing))
+
+    struct = {}
+    for _, key, phi_component in SECTIONS:
+        body = bodies[key]
+        if key in ['S', 'V', 'F']:
+            items = [item.strip() for _, line in body for item in line.split(',')]
+            struct[key] = [item for item in items if item]
+        elif key == 'n':
+            if len(body) > 1:
+                raise QuerySyntaxError(phi_component, "Expected a single value", body[1][0], 1)
+            struct[key] = body[0][1] if body else '0'
+        elif key == 'sigma':
+            struct[key] = [line for _, line in body]
+        else:
+            if not body:
+                struct[key] = []
+                continue
+            having = ' '.join(line for _, line in body)
+            struct[key] = [unparse(parse_expression(having, phi_component, body[0][0]))]
+    return struct
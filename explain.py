@@ -0,0 +1,131 @@
+# I pledge my honor that I've abided by the Stevens Honor System
+# Steven DeFalco
+# Lucas Hope
+import os
+import math
+import random
+from phi import split_aggregate
+
+'''
+EXPLAIN output for the generator: the physical plan of a query with cardinality estimates.
+Estimates come from table statistics and a sample of rows (see connect.get_statistics), so planning
+does not need the whole table. EXPLAIN ANALYZE has the table anyway and samples the fetched rows.
+'''
+
+SAMPLE_SIZE = 1000
+
+
+def sample_rows(rows, size=SAMPLE_SIZE, seed=0):
+    if len(rows) <= size:
+        return rows
+    return random.Random(seed).sample(rows, size)
+
+
+def local_statistics(rows):
+    """Statistics of rows that are already fetched: the exact row count, distinct values and indexes unknown"""
+    return {'rows': len(rows), 'n_distinct': {}, 'indexes': None, 'minimums': {}}
+
+
+def estimate_groups(statistics, sample, grouping, col_names):
+    """Estimates the number of distinct grouping values (the H table size).
+
+    With distinct counts for every grouping attribute this is their product (assuming independent columns),
+    otherwise it is the GEE estimator over the sample: sqrt(N / n) * (values seen once) + (values seen more than once)
+    """
+    row_count = statistics['rows']
+    if all(att in statistics['n_distinct'] for att in grouping):
+        return min(row_count, math.prod(statistics['n_distinct'][att] for att in grouping))
+    if not sample:
+        return 0
+    counts = {}
+    for row in sample:
+        key = tuple(row[col_names[att]] for att in grouping)
+        counts[key] = counts.get(key, 0) + 1
+    once = sum(1 for count in counts.values() if count == 1)
+    estimate = math.sqrt(row_count / len(sample)) * once + (len(counts) - once)
+    return min(row_count, round(estimate))
+
+
+def estimate_selectivity(predicate, sample):
+    """Fraction of the sample rows that pass a compiled condition"""
+    if not sample:
+        return 0
+    return sum(1 for row in sample if predicate(row)) / len(sample)
+
+
+def make_plan(mf_struct, statistics, sample, col_names, predicates, condition_sources, conjuncts, bounds, order_by, sample_rate):
+    """Returns the plan as a list of (step, operator, detail, estimated rows) in execution order.
+
+    statistics is from connect.get_statistics or local_statistics and sample is a sample of the encoded rows,
+    predicates maps each grouping variable to its compiled σ predicate and condition_sources to its source,
+    conjuncts is a list of (stage, having conjunct text) and bounds lists the aggregates that prune early.
+    """
+    grouping = mf_struct['V']
+    groups = estimate_groups(statistics, sample, grouping, col_names)
+    row_count = statistics['rows']
+    scanned = round(row_count * sample_rate)
+
+    source = f"local snapshot {os.getenv('SNAPSHOT')}" if os.getenv('SNAPSHOT') else "SELECT * FROM sales"
+    plan = [('fetch', source, "no filters pushed down, full table", row_count)]
+    if statistics['indexes']:
+        # σ is evaluated in memory after the fetch, so no index can narrow the rows that are read
+        names = [definition.split(' ON ')[0].split()[-1] for definition in statistics['indexes']]
+        plan.append(('indexes', f"not used: {', '.join(names)}", "conditions are applied to the fetched rows", ''))
+
+    def having_step(stage, groups_in):
+        stage_conjuncts = [text for conjunct_stage, text in conjuncts if conjunct_stage == stage]
+        if stage_conjuncts:
+            plan.append((f'having {stage}', 'filter groups', ' and '.join(stage_conjuncts), f"<= {groups_in}"))
+
+    whole = [agg for agg in mf_struct['F'] if split_aggregate(agg)[0] is None]
+    detail = f"hash lookup on ({', '.join(grouping)})"
+    if whole:
+        detail += f"; aggregates: {', '.join(whole)}"
+    if sample_rate < 1:
+        detail += f"; Bernoulli sample rate {round(sample_rate, 4)}"
+    plan.append(('scan 0', 'full scan, create groups', detail, f"{scanned} rows -> {groups} groups"))
+    having_step(0, groups)
+
+    for i in range(1, mf_struct['n'] + 1):
+        matched = round(scanned * estimate_selectivity(predicates[i], sample))
+        aggregates = [agg for agg in mf_struct['F'] if split_aggregate(agg)[0] == i]
+        conditions = [cond for cond in mf_struct['sigma'] if cond.split('.')[0].strip() == str(i)]
+        detail = f"σ: {' and '.join(conditions) or 'none'} (compiled: {condition_sources[i]})"
+        detail += f"; aggregates: {', '.join(aggregates) or 'none'}"
+        plan.append((f'scan {i}', 'full scan, fused σ filter and update', detail, f"{scanned} rows -> {matched} matched"))
+        having_step(i, groups)
+
+    if bounds:
+        plan.append(('prune', 'monotone bounds during scans', ', '.join(bounds), ''))
+    plan.append(('finalize', 'finalize aggregates of surviving groups', ', '.join(mf_struct['F']) or 'none', f"<= {groups}"))
+    output = f"project {', '.join(mf_struct['S'])}"
+    if order_by != 0:
+        output += f"; sort by {', '.join(grouping[:order_by])}"
+    if sample_rate < 1:
+        output += "; approximate with 95% confidence intervals"
+    plan.append(('output', 'project and print', output, f"<= {groups}"))
+    return plan
+
+
+def print_plan(plan):
+    import tabulate
+    print("QUERY PLAN")
+    print(tabulate.tabulate(plan, headers=['step', 'operator', 'detail', 'estimated rows'], tablefmt='grid'))
+
+
+def print_analysis(plan, stats):
+    """Prints the plan with the actual time and rows of each step next to its estimate (EXPLAIN ANALYZE).
+    stats is a list of (step, actual ms, rows in, rows out), steps without a plan entry are left out."""
+    import tabulate
+    actual = {step: (ms, rows_in, rows_out) for step, ms, rows_in, rows_out in stats}
+    rows = []
+    for step, operator, detail, estimate in plan:
+        if step in actual:
+            ms, rows_in, rows_out = actual[step]
+            rows_actual = rows_out if step == 'fetch' else f"{rows_in} rows -> {rows_out}"
+            rows.append((step, operator, detail, estimate, rows_actual, ms))
+        else:
+            rows.append((step, operator, detail, estimate, '', ''))
+    print("QUERY PLAN (EXPLAIN ANALYZE)")
+    print(tabulate.tabulate(rows, headers=['step', 'operator', 'detail', 'estimated rows', 'actual rows', 'actual ms'],
+                            tablefmt='grid'))
@@ -1,18 +1,31 @@
 # I pledge my honor that I've abided by the Stevens Honor System
 # Steven DeFalco
 # Lucas Hope
-import subprocess
-from connect import get_database
-from phi import PhiOperator
+import sys
+import time
+import bisect
+import datetime
+from connect import get_database, get_statistics, DATE_OID
+from phi import PhiOperator, split_aggregate, percentile
+from esql import parse_condition, parse_expression, names, to_python, unparse, QuerySyntaxError
+from esql import Name, Literal, UnaryOp, Compare, BoolOp
 import os
 
 def get_query_file_path():
     """Prompts the user for a query file, checks its existence, and returns the path.
+    A query file name given on the command line (e.g. python generator.py demo1.txt) skips the prompt.
 
     Returns:
         The path to the valid query file if it exists, or None otherwise.
     """
 
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if len(args) != 0:
+        file_path = os.path.join("queries", args[0])
+        if os.path.exists(file_path):
+            return file_path
+        print(f"Error: File '{args[0]}' does not exist in the 'queries' directory.")
+
     # prints all names of queries
     files = os.listdir("./queries")
     print()
@@ -54,7 +67,7 @@ def get_query_file_path():
                 f.write("SELECT CONDITION-VECT([σ]):\n")
                 for cond in sigmas:
                     f.write(cond.strip() + '\n')
-                g = input("Input having clause (with spaces between different entities): ")
+                g = input("Input having clause: ")
                 f.write("HAVING_CONDITION(G):\n")
                 f.write(g)
                 print()
@@ -63,11 +76,22 @@ def get_query_file_path():
 
 def main():
     
+    # --explain prints the query plan instead of running the query, --analyze runs it and adds actual timings
+    analyze = '--analyze' in sys.argv
+    explain = '--explain' in sys.argv or analyze
+
     # Gets the file path for the query input
     file_path = get_query_file_path()
 
-    # Connects to the database
-    database, columns, column_datatypes = get_database()
+    # Connects to the database, EXPLAIN alone only needs table statistics and a sample of the rows
+    statistics = None
+    if explain and not analyze:
+        database, columns, column_datatypes, dictionaries, statistics = get_statistics()
+    else:
+        # EXPLAIN ANALYZE reports the fetch (query round trip and encode_rows) as the first step
+        start = time.perf_counter()
+        database, columns, column_datatypes, dictionaries = get_database()
+        fetch_stats = ('fetch', round((time.perf_counter() - start) * 1000, 2), len(database), len(database))
 
 
     # create the mf_struct
@@ -84,6 +108,121 @@ def main():
     for i, attrib in enumerate(columns):
         col_names[attrib] = i
 
+    # Compile the conditions of each grouping variable once into a predicate over a row,
+    # e.g. {1: lambda row: (row[5] == 3)}, instead of substituting and evaluating strings per row
+    def resolve(name):
+        # names marked with @ compare decoded strings instead of dictionary codes
+        decoded = name.startswith('@')
+        name = name[1:] if decoded else name
+        if name not in col_names:
+            raise QuerySyntaxError('SELECT CONDITION-VECT([σ])', f"Unknown attribute {name}")
+        if decoded:
+            return f"dictionaries[{name!r}][row[{col_names[name]}]]"
+        return f"row[{col_names[name]}]"
+
+    def encode_condition(node):
+        # rows hold date ordinals and dictionary codes, so compare them against encoded literals
+        if isinstance(node, BoolOp):
+            return BoolOp(node.op, [encode_condition(value) for value in node.values])
+        if isinstance(node, UnaryOp):
+            return UnaryOp(node.op, encode_condition(node.operand))
+        if isinstance(node, Name) and node.id in dictionaries:
+            # codes are only ordered within their own column, so anything else needs the string
+            return Name('@' + node.id)
+        if not isinstance(node, Compare):
+            return node
+        flipped = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '==': '==', '!=': '!='}
+        if isinstance(node.left, Literal) and isinstance(node.right, Name):
+            node = Compare(flipped[node.op], node.right, node.left)
+        if isinstance(node.left, Name) and isinstance(node.right, Name) and node.left.id == node.right.id:
+            return node
+        if not (isinstance(node.left, Name) and isinstance(node.right, Literal)):
+            return Compare(node.op, encode_condition(node.left), encode_condition(node.right))
+        name, op, value = node.left.id, node.op, node.right.value
+        encoded = column_datatypes.get(name) == DATE_OID or name in dictionaries
+        if encoded and not isinstance(value, str):
+            # a date or string never equals a number
+            if op in ['==', '!=']:
+                return Literal(op == '!=')
+            raise QuerySyntaxError('SELECT CONDITION-VECT([σ])', f"Cannot compare {name} with {value!r}")
+        if column_datatypes.get(name) == DATE_OID:
+            try:
+                return Compare(op, node.left, Literal(datetime.date.fromisoformat(value).toordinal()))
+            except ValueError:
+                raise QuerySyntaxError('SELECT CONDITION-VECT([σ])', f"Dates must be written as 'YYYY-MM-DD': {value}")
+        if name in dictionaries:
+            values = dictionaries[name]
+            code = bisect.bisect_left(values, value)
+            if code < len(values) and values[code] == value:
+                return Compare(op, node.left, Literal(code))
+            # the value is not in the table, codes before its position are smaller strings
+            if op in ['==', '!=']:
+                return Compare(op, node.left, Literal(-1))
+            return Compare('<' if op in ['<', '<='] else '>=', node.left, Literal(code))
+        return node
+
+    condition_sources = {}
+    try:
+        parsed_conditions = [parse_condition(cond) for cond in mf_struct['sigma']]
+        for i in range(1, mf_struct['n'] + 1):
+            ith_conditions = [to_python(encode_condition(node), resolve) for group, node in parsed_conditions if group == i]
+            condition_sources[i] = f"lambda row: {' and '.join(ith_conditions) or 'True'}"
+    except QuerySyntaxError as syntax_error:
+        print(syntax_error)
+        sys.exit(1)
+    condition_predicates = '{' + ', '.join(f"{i}: {source}" for i, source in condition_sources.items()) + '}'
+    # the same predicates as functions, for sizing samples and for EXPLAIN
+    predicates = {i: eval(source, {'dictionaries': dictionaries}) for i, source in condition_sources.items()}
+
+    # Compile the having clause once into predicates over the aggregates of an H row. Each top-level 'and'
+    # conjunct is applied right after the pass that completes its aggregates, so later passes and the
+    # finalization skip groups that already failed, e.g. (1, ['1_sum_quant'], lambda h: (h['1_sum_quant'] > 100))
+    def nonnegative(attribute):
+        # EXPLAIN alone only has a sample of the rows, so it uses the column's minimum over the whole table
+        if statistics is not None:
+            minimum = statistics['minimums'].get(attribute)
+            return minimum is not None and minimum >= 0
+        return all(row[col_names[attribute]] >= 0 for row in database)
+
+    def upper_bound(node):
+        # count, and sum over a column with no negative values, only grow while scanning,
+        # so a conjunct like 1_count_quant <= 5 fails for good once it is exceeded
+        if not isinstance(node, Compare):
+            return None
+        if isinstance(node.left, Name) and isinstance(node.right, Literal) and node.op in ['<', '<=']:
+            name, op, bound = node.left.id, node.op, node.right.value
+        elif isinstance(node.left, Literal) and isinstance(node.right, Name) and node.op in ['>', '>=']:
+            name, op, bound = node.right.id, '<' if node.op == '>' else '<=', node.left.value
+        else:
+            return None
+        if isinstance(bound, str):
+            return None
+        group, function, attribute = split_aggregate(name)
+        if function == 'sum' and nonnegative(attribute):
+            return name, f"lambda value: value {op} {bound!r}"
+        if function == 'count':
+            return name, f"lambda value: value {op} {bound!r}"
+        return None
+
+    conjuncts = []
+    bounds = []
+    # (stage, text) of each conjunct and the aggregates with bounds, for EXPLAIN
+    conjunct_texts = []
+    bound_names = []
+    if len(mf_struct['G']) != 0:
+        having = parse_expression(mf_struct['G'][0], 'HAVING CLAUSE(G)')
+        nodes = having.values if isinstance(having, BoolOp) and having.op == 'and' else [having]
+        for node in nodes:
+            keys = list(dict.fromkeys(names(node)))
+            stage = max([split_aggregate(key)[0] or 0 for key in keys], default=0)
+            conjuncts.append(f"({stage}, {keys}, lambda h: {to_python(node, lambda name: f'h[{name!r}]')})")
+            conjunct_texts.append((stage, unparse(node)))
+            bound = upper_bound(node)
+            if bound is not None:
+                bounds.append(f"{bound[0]!r}: {bound[1]}")
+                bound_names.append(unparse(node))
+    having_conjuncts = '[' + ', '.join(conjuncts) + ']'
+
     # Ask if the user wants the resulting table sorted
     num_group_by = len(mf_struct['V'])
     order_by_ = 0
@@ -96,7 +235,62 @@ def main():
         except Exception:
             order_by_ = 0
 
+    # Ask if the user wants approximate aggregates for faster interactive results
+    error_target = None
+    rate = 1.0
+    precision = 12
+    if len(mf_struct['F']) != 0:
+        error_target = input("Input an error target for approximate aggregates (e.g. 0.05, blank for exact): ")
+        try:
+            error_target = float(error_target)
+            error_target = error_target if 0 < error_target < 1 else None
+        except Exception:
+            error_target = None
+    if error_target is not None:
+        from sketches import sample_rate, relative_variance, hll_precision, MAX_SAMPLE_RATE
+        from explain import sample_rows, local_statistics, estimate_groups, estimate_selectivity
+        # size the sample for the smallest cells: the rows of one group that pass the σ of a grouping variable
+        sample = sample_rows(database)
+        table = statistics or local_statistics(database)
+        groups = estimate_groups(table, sample, mf_struct['V'], col_names)
+        selectivity = min([estimate_selectivity(predicate, sample) for predicate in predicates.values()], default=1)
+        group_rows = table['rows'] / max(1, groups) * selectivity
+        summed = {split_aggregate(agg)[2] for agg in mf_struct['F'] if split_aggregate(agg)[1] in ['sum', 'avg']}
+        spread = max([relative_variance(row[col_names[att]] for row in sample) for att in summed], default=0)
+        rate = sample_rate(error_target, group_rows, spread)
+        if rate > MAX_SAMPLE_RATE:
+            print(f"An error target of {error_target} per group needs a sample rate of {round(rate, 2)}, "
+                  "running the exact query instead")
+            error_target = None
+            rate = 1.0
+    if error_target is not None:
+        precision = hll_precision(error_target)
+        # the bounds apply to exact values, sampled counts and sums are only scaled at the end
+        bounds = []
+        bound_names = []
+    having_bounds = '{' + ', '.join(bounds) + '}'
+
+    # the generated code only imports the sketches that its aggregates need
+    functions = [split_aggregate(agg)[1].lower() for agg in mf_struct['F']]
+    sketch_names = ['Z_95', 'HyperLogLog', 'bernoulli_mask'] if error_target is not None else []
+    if 'var' in functions or 'stddev' in functions:
+        sketch_names.append('Moments')
+    if any(function == 'median' or percentile(function) is not None for function in functions):
+        sketch_names.append('QuantileSketch')
+    sketch_import = f"from sketches import {', '.join(sketch_names)}" if sketch_names else ''
+
     print()
+
+    plan = None
+    if explain:
+        from explain import make_plan, print_plan, sample_rows, local_statistics
+        plan = make_plan(mf_struct, statistics or local_statistics(database), sample_rows(database), col_names,
+                         predicates, condition_sources, conjunct_texts, bound_names, order_by_, rate)
+        # EXPLAIN ANALYZE prints the plan after the run, with the actual numbers next to the estimates
+        if not analyze:
+            print_plan(plan)
+            print()
+            return
     
     """
     This is the generator code. It should take in the MF structure and generate the code
@@ -108,11 +302,23 @@ def main():
     
     class H:
         '''Class to define one row in the H table'''
-        def __init__(self, groupingAttributes, data, aggregates):
+        def __init__(self, groupingAttributes, data, aggregates, key):
             self.groupingAttributes = groupingAttributes
+            self.key = key
             self.aggregates = aggregates
             self.data = data
             self.map = self.make_map()
+            # sums of squares and confidence intervals for approximate aggregates
+            self.squares = {}
+            self.intervals = {}
+            # estimates without a confidence interval (sketch quantiles, or sampled min, max, var...)
+            self.estimated = set()
+            # sampled rows fed to each aggregate, and the sampled aggregates that got none
+            self.sampled = {}
+            self.unsampled = set()
+            # aggregates already turned into their final values, and whether the group failed the having clause
+            self.finalized = set()
+            self.pruned = False
 
         def __str__(self):
             result = ''
@@ -127,40 +333,29 @@ def main():
             map = {}
             for att in self.groupingAttributes:
                 idx = column_names[att]
-                map[att] = self.data[idx]
+                map[att] = decode(att, self.data[idx])
             for aggre in self.aggregates:
-                agg_list = aggre.split('_')
-                # get the aggregate function (i.e. sum) and attribute (i.e. quant)
-                if len(agg_list) == 2:
-                    agg, att = agg_list[0], agg_list[1]    
-                    att_idx = column_names[att]
-                    att_val = row[att_idx]
-                    if agg in ['sum', 'min', 'max']:
-                        map[aggre] = att_val
-                    elif agg == 'count':
-                        map[aggre] = 1
-                    elif agg == 'avg':
-                        map[aggre] = {'sum': att_val, 'count': 1, 'avg': att_val}
-                else:
-                    agg, att = agg_list[1], agg_list[2]    
-                    if agg in ['sum', 'count']:
-                        map[aggre] = 0
-                    elif agg == 'min':
-                        map[aggre] = sys.maxsize
-                    elif agg == 'max':
-                        map[aggre] = - sys.maxsize - 1
-                    elif agg == 'avg':
-                        map[aggre] = {'sum': 0, 'count': 0, 'avg': 0}
+                group, agg, att = split_aggregate(aggre)
+                if agg in ['sum', 'count']:
+                    map[aggre] = 0
+                elif agg == 'min':
+                    map[aggre] = sys.maxsize
+                elif agg == 'max':
+                    map[aggre] = - sys.maxsize - 1
+                elif agg == 'avg':
+                    map[aggre] = {'sum': 0, 'count': 0, 'avg': 0}
+                elif agg == 'count_distinct':
+                    map[aggre] = HyperLogLog(hllPrecision) if approximate else set()
+                elif agg in ['var', 'stddev']:
+                    map[aggre] = Moments()
+                elif agg == 'median' or percentile(agg) is not None:
+                    map[aggre] = QuantileSketch()
             return map 
 
         def set_attribute_value(self, aggregate, row):
             # e.g. aggregate = '1_sum_quant' or 'sum_quant'
-            agg_list = aggregate.split('_')
             # get the aggregate function (i.e. sum) and attribute (i.e. quant)
-            if len(agg_list) == 2:
-                agg, att = agg_list[0], agg_list[1]    
-            else: 
-                agg, att = agg_list[1], agg_list[2]
+            group, agg, att = split_aggregate(aggregate)
             att_idx = column_names[att]
             att_val = row[att_idx]
             # Perform appropriate update depending on aggregate
@@ -186,137 +381,189 @@ def main():
                 self.map[aggregate] = {'sum': new_sum, 
                                        'count': new_count, 
                                        'avg': (new_sum/new_count)}
-            
-        def get_grouping_values(self):
-            result_list = []
-            for var in self.groupingAttributes:
-                result_list.append(self.map[var])
-            return set(result_list)
+            elif agg.lower() in ['count_distinct', 'var', 'stddev', 'median'] or percentile(agg) is not None:
+                # sketches keep bounded, mergeable state instead of every value
+                self.map[aggregate].add(att_val)
+            self.sampled[aggregate] = self.sampled.get(aggregate, 0) + 1
+            # scaled sums need the sum of squares for their confidence interval
+            if approximate and agg.lower() in ['sum', 'avg']:
+                self.squares[aggregate] = self.squares.get(aggregate, 0) + float(att_val) ** 2
+            # monotone aggregates past an upper bound in the having clause can never pass it
+            bound = havingBounds.get(aggregate)
+            if bound is not None and not bound(self.map[aggregate]):
+                self.pruned = True
+
+        def finalize(self, keys):
+            # turn the running state of the aggregates into their final values
+            for key in keys:
+                if key in self.finalized:
+                    continue
+                self.finalized.add(key)
+                value = self.map[key]
+                group, agg, att = split_aggregate(key)
+                if agg.lower() == 'avg':
+                    # full precision for the having clause, values are rounded when projected
+                    self.map[key] = value['avg']
+                    if approximate and value['count'] != 0:
+                        variance = max(0, self.squares.get(key, 0) / value['count'] - float(value['avg']) ** 2)
+                        self.intervals[key] = Z_95 * math.sqrt(variance / value['count'])
+                elif agg.lower() in ['sum', 'count'] and approximate:
+                    # scale by the sample rate, the variance of the estimate is (1 - p) / p^2 * sum(x^2)
+                    squares = value if agg.lower() == 'count' else self.squares.get(key, 0)
+                    self.map[key] = float(value) / sampleRate
+                    self.intervals[key] = Z_95 * math.sqrt((1 - sampleRate) * squares) / sampleRate
+                elif agg.lower() == 'count_distinct':
+                    if approximate:
+                        self.intervals[key] = Z_95 * value.standard_error() * value.estimate()
+                    self.map[key] = len(value)
+                elif agg.lower() == 'var':
+                    self.map[key] = value.variance()
+                elif agg.lower() == 'stddev':
+                    self.map[key] = value.stddev()
+                elif agg.lower() == 'median' or percentile(agg) is not None:
+                    if not value.is_exact():
+                        self.estimated.add(key)
+                    self.map[key] = value.quantile(0.5 if agg.lower() == 'median' else percentile(agg))
+                if approximate and agg.lower() != 'count_distinct':
+                    # count_distinct scans every row, so groups can exist with no sampled rows
+                    if self.sampled.get(key, 0) == 0:
+                        self.unsampled.add(key)
+                    elif key not in self.intervals:
+                        self.estimated.add(key)
+
+
+
+    def decode(att, value):
+        # rows are stored compactly, turn dictionary codes and date ordinals back into values
+        if att in dictionaries:
+            return dictionaries[att][value]
+        if att in dateColumns and value is not None:
+            return datetime.date.fromordinal(value)
+        return value
+
+
+    stats = [fetchStats] if analyze else []
+    def record(operator, start, rows_in, rows_out):
+        # EXPLAIN ANALYZE: actual time and row counts of each operator
+        if analyze:
+            stats.append((operator, round((time.perf_counter() - start) * 1000, 2), rows_in, rows_out))
+
+
+    def having_filter(hTable, stage):
+        # keep the groups that pass every having conjunct whose aggregates are complete after this pass
+        conjuncts = [conjunct for conjunct in havingConjuncts if conjunct[0] == stage]
+        result_hTable = []
+        for h_row in hTable:
+            if h_row.pruned:
+                continue
+            for _, keys, predicate in conjuncts:
+                h_row.finalize(keys)
+            # like a comparison with NULL, a conjunct over an aggregate with no sampled rows does not hold
+            if any(key in h_row.unsampled for _, keys, _ in conjuncts for key in keys):
+                continue
+            if all(predicate(h_row.map) for _, _, predicate in conjuncts):
+                result_hTable.append(h_row)
+        return result_hTable
+
 
+    # H table rows by the tuple of their grouping attribute values
+    groups = {}
+    groupingIndexes = [column_names[var] for var in groupingVariables]
 
-    hTable = []
+    # rows in the Bernoulli sample (every row when not approximate), count_distinct always sees every row
+    inSample = bernoulli_mask(len(db), sampleRate) if approximate else [True] * len(db)
+    hasDistinct = any(split_aggregate(agg)[1] == 'count_distinct' for agg in fVector)
 
     # First pass initialzing H table
     # iterate through each row of the sales database
-    for row in db:
-        groupingValues = []
-        for var in groupingVariables:
-            groupingValues.append(row[column_names[var]])
-        groupingValues = set(groupingValues)
-        inHTable= False
-        for h_row in hTable:
-            # if grouped row already exists in H table, update it
-            if groupingValues == h_row.get_grouping_values():
-                inHTable = True
-                for agg in fVector:
-                    agg_list = agg.split('_')
-                    if len(agg_list) == 2:
-                        h_row.set_attribute_value(agg, row)
-                break
+    start = time.perf_counter()
+    for row_idx, row in enumerate(db):
+        sampled = inSample[row_idx]
+        if not sampled and not hasDistinct:
+            continue
+        groupingValues = tuple(row[idx] for idx in groupingIndexes)
+        # if grouped row already exists in H table, update it
+        groupRow = groups.get(groupingValues)
         # if not in H table, create new H table row and add to H table
-        if not inHTable:
-            new_h_row = H(groupingVariables, row, fVector)
-            hTable.append(new_h_row)
+        if groupRow is None:
+            groupRow = H(groupingVariables, row, fVector, groupingValues)
+            groups[groupingValues] = groupRow
+        if groupRow.pruned:
+            continue
+        for agg in fVector:
+            group, func, att = split_aggregate(agg)
+            if group is None and (sampled or func == 'count_distinct'):
+                groupRow.set_attribute_value(agg, row)
 
+    record('scan 0', start, len(db), len(groups))
+
+    # aggregates over the whole group are complete, so their having conjuncts can be applied
+    start = time.perf_counter()
+    hTable = having_filter(list(groups.values()), 0)
+    record('having 0', start, len(groups), len(hTable))
+    groups = {h_row.key: h_row for h_row in hTable}
 
 
     # One pass for each grouping variable
     for i in range(1, numberGrouping + 1):
-        # e.g. of ith_condition = state='NJ'
-        ith_conditions = []
-        # get (sigma) conditions for ith group 
-        for cond in conditions:
-            split_cond = cond.split(".")
-            if split_cond[0] == str(i):
-                ith_conditions.append(split_cond[1])
-        #  e.g. of parsed_condition = (<idx-of-attribute>, <attrib-val>, <operator>)
-        parsed_conditions = []
-        for cond in ith_conditions:
-            if '>' in cond and '=' not in cond:
-                cl = cond.split('>')
-                parsed_conditions.append(f'{cl[0]} > {cl[1]}')
-            elif '<' in cond and '=' not in cond:
-                cl = cond.split('<')
-                parsed_conditions.append(f'{cl[0]} < {cl[1]}')
-            elif '=' in cond and '>' not in cond and '<' not in cond:
-                cl = cond.split('=')
-                parsed_conditions.append(f'{cl[0]} == {cl[1]}')
-            elif '<=' in cond:
-                cl = cond.split('<=')
-                parsed_conditions.append(f'{cl[0]} <= {cl[1]}')
-            elif '>=' in cond:
-                cl = cond.split('>=')
-                parsed_conditions.append(f'{cl[0]} >= {cl[1]}')
-        for row in db:
-            allTrue = True
-            for cond in parsed_conditions:
-                # if condition is met, check next condition to determine if all true
-                cond_list = cond.split()
-                result_tokens = []
-                for token in cond_list:
-                    try: 
-                        token_val = row[column_names[token]]
-                        if isinstance(token_val, str):
-                            token_val = "'" + token_val + "'"
-                        if isinstance(token_val, datetime.date):
-                            token_val = "'" + str(token_val) + "'"
-                        result_tokens.append(str(token_val))
-                    except:
-                        result_tokens.append(str(token))
-                logic_statement = " ".join(result_tokens)
-                if not eval(logic_statement):
-                    allTrue = False
+        # compiled (sigma) conditions for ith group, e.g. lambda row: (row[5] == 3)
+        predicate = conditionPredicates[i]
+        start = time.perf_counter()
+        matched = 0
+        for row_idx, row in enumerate(db):
+            sampled = inSample[row_idx]
+            if not sampled and not hasDistinct:
+                continue
             # if all conditions are met...
-            if allTrue:
+            if predicate(row):
+                matched += 1
                 # then update rows in H table
-                groupingValues = []
-                for var in groupingVariables:
-                    groupingValues.append(row[column_names[var]])
-                groupingValues = set(groupingValues)
-                for h_row in hTable:
-                    # find the h_row that we need to update, should exist already
-                    if groupingValues == h_row.get_grouping_values():
-                        for agg in fVector:
-                            agg_list = agg.split('_')
-                            if len(agg_list) == 3 and agg_list[0] == str(i):
-                                h_row.set_attribute_value(agg, row)
+                # find the h_row that we need to update, missing when the group was already pruned
+                h_row = groups.get(tuple(row[idx] for idx in groupingIndexes))
+                if h_row is None or h_row.pruned:
+                    continue
+                for agg in fVector:
+                    group, func, att = split_aggregate(agg)
+                    if group == i and (sampled or func == 'count_distinct'):
+                        h_row.set_attribute_value(agg, row)
 
+        record(f'scan {i}', start, len(db), matched)
 
-    for h_row in hTable:
-        for key, value in h_row.map.items():
-            split_att = key.split('_')
-            agg = split_att[1] if len(split_att) == 3 else split_att[0]
-            if agg.lower() == 'avg':
-                avg_val = round(h_row.map[key]['avg'], 2)
-                h_row.map[key] = avg_val
+        # prune groups that fail the having conjuncts of this grouping variable before the next pass
+        start = time.perf_counter()
+        hTable = having_filter(hTable, i)
+        record(f'having {i}', start, len(groups), len(hTable))
+        groups = {h_row.key: h_row for h_row in hTable}
 
 
-    if len(havingClause) != 0:
-        result_hTable = []
-        # Iterate through each h_row to check if meets having condition
-        for h_row in hTable:
-            having_tokens = havingClause[0].split()
-            result_tokens = []
-            for token in having_tokens:
-                token = '==' if token == '=' else token
-                try: 
-                    token_val = h_row.map[token]
-                    result_tokens.append(str(token_val))
-                except:
-                    result_tokens.append(str(token))
-            logic_statement = " ".join(result_tokens)
-            if eval(logic_statement):
-                result_hTable.append(h_row)
-        hTable = result_hTable
+    # the having clause is fully applied, finalize the remaining aggregates of the surviving groups
+    start = time.perf_counter()
+    for h_row in hTable:
+        h_row.finalize(fVector)
+    record('finalize', start, len(hTable), len(hTable))
 
 
+    start = time.perf_counter()
     newHTable = []
+    sketched = any(h_row.estimated for h_row in hTable)
+    unsampled = any(h_row.unsampled for h_row in hTable)
 
     # project only the attributes given in the SELECT clause
     for h_row in hTable:
         projected_h_row = {}
         for key, value in h_row.map.items():
             if key in selectAttributes:
+                # computed aggregates (floats, or Decimal for NUMERIC columns) are shown to 2 decimal places
+                if key not in groupingVariables and isinstance(value, numbers.Number) and not isinstance(value, int):
+                    function = split_aggregate(key)[1].lower()
+                    if key in h_row.intervals or function in ['avg', 'var', 'stddev', 'median'] or percentile(function) is not None:
+                        value = round(value, 2)
+                if key in h_row.unsampled:
+                    value = 'n/a'
+                elif key in h_row.intervals:
+                    value = f"{value} ± {round(h_row.intervals[key], 2)}"
+                elif key in h_row.estimated:
+                    value = f"~{value}"
                 projected_h_row[key] = value 
         newHTable.append(projected_h_row)
     
@@ -326,6 +573,7 @@ def main():
         newHTable.sort(key=lambda x: tuple(x.get(key, '') for key in sort_order))
 
     hTable = newHTable
+    record('output', start, len(hTable), len(hTable))
 
 
     """
@@ -334,14 +582,13 @@ def main():
     #       Also, note the indentation is preserved.
 
     tmp = f"""
-import os
 import sys
-import psycopg2
-import psycopg2.extras
-import tabulate
+import math
+import time
+import numbers
 import datetime
-from dotenv import load_dotenv
-from connect import get_database
+from phi import split_aggregate, percentile
+{sketch_import}
 
 # DO NOT EDIT THIS FILE, IT IS GENERATED BY generator.py
 
@@ -350,16 +597,43 @@ numberGrouping = {mf_struct["n"]}
 groupingVariables = {mf_struct["V"]}
 fVector = {mf_struct["F"]}
 conditions = {mf_struct["sigma"]}
+conditionPredicates = {condition_predicates}
 havingClause = {mf_struct["G"]}
+havingConjuncts = {having_conjuncts}
+havingBounds = {having_bounds}
 
-db = {repr(database)}
+# db (the encoded rows), dictionaries, and for EXPLAIN ANALYZE queryPlan and fetchStats are passed in by generator.py
 column_names = {col_names}
+dateColumns = {[name for name in columns if column_datatypes[name] == DATE_OID]}
 
 order_by = {order_by_}
 
+approximate = {error_target}
+sampleRate = {rate}
+hllPrecision = {precision}
+
+analyze = {analyze}
+
 def main():
     {body}
+    # only needed once there is a table to print
+    import tabulate
     print(tabulate.tabulate(hTable, headers='keys', tablefmt='grid'))
+    if approximate:
+        print(f"APPROXIMATE RESULT: error target {{approximate}} per group, sample rate {{round(sampleRate, 4)}}, "
+              "± values are 95% confidence intervals")
+        if not hasDistinct:
+            print("Groups with no rows in the sample are missing from the result")
+        if sketched:
+            print("~ values are estimates from the sample without a confidence interval")
+        if unsampled:
+            print("n/a values had no rows in the sample")
+    elif sketched:
+        print("~ values are estimated by a quantile sketch (medians and percentiles of more than 200 values)")
+    if analyze:
+        from explain import print_analysis
+        print()
+        print_analysis(queryPlan, stats)
     
 if "__main__" == __name__:
     main()
@@ -367,10 +641,15 @@ if "__main__" == __name__:
 
     # Write the generated code to a file
     open("_generated.py", "w").write(tmp)
-    # Execute the generated code
-    subprocess.run(["python", "_generated.py"])
-    # Remove the generated code after execution
-    os.remove("_generated.py")
+    # Execute the generated code in this interpreter with the rows already in memory
+    try:
+        with open("_generated.py", "r") as f:
+            exec(compile(f.read(), "_generated.py", "exec"),
+                 {"__name__": "__main__", "db": database, "dictionaries": dictionaries,
+                  "queryPlan": plan, "fetchStats": fetch_stats if analyze else None})
+    finally:
+        # Remove the generated code after execution
+        os.remove("_generated.py")
 
 
 if "__main__" == __name__:
@@ -5,6 +5,37 @@ import sys
 import re
 import calendar
 import warnings
+from esql import parse_query, parse_expression, parse_condition, names, unparse, QuerySyntaxError
+from esql import Name, Literal, UnaryOp, BinOp, Compare, BoolOp
+
+# aggregate functions that need a numerical column, and ones that work on any column
+NUMERICAL_AGGREGATES = ['avg', 'min', 'max', 'sum', 'var', 'stddev', 'median']
+GENERAL_AGGREGATES = ['count', 'count_distinct']
+
+
+def percentile(function):
+    """Returns the quantile for percentile aggregates such as p90 (0.9), or None for other functions"""
+    match = re.fullmatch(r'p([1-9][0-9]?)', function)
+    if match is None:
+        return None
+    return int(match.group(1)) / 100
+
+
+def split_aggregate(aggregate):
+    """Splits an aggregate into (grouping variable, function, attribute).
+
+    e.g. '1_sum_quant' -> (1, 'sum', 'quant') and 'count_distinct_cust' -> (None, 'count_distinct', 'cust').
+    The grouping variable is None for aggregates over the whole group.
+    Raises a ValueError when the aggregate does not have a function and an attribute.
+    """
+    parts = aggregate.strip().split('_')
+    group = None
+    if parts[0].isdigit():
+        group = int(parts.pop(0))
+    if len(parts) < 2:
+        raise ValueError(f"Invalid aggregate: {aggregate}")
+    return group, '_'.join(parts[:-1]), parts[-1]
+
 
 class PhiOperator:
     """Class to perform operations with the Phi Operator and ESQL"""
@@ -14,113 +45,13 @@ class PhiOperator:
 
     def make_struct(self):
         """Makes the mf_struct given raw txt in the input query before any input error checking"""
-        struct = {}
-        lines = []
         with open(self.file, 'r') as f:
-            for line in f:
-                if not line:
-                    continue
-                lines.append(line)
-        curr_idx = 0
-        while curr_idx < len(lines):
-            line = lines[curr_idx]
-            '''
-            SELECT ATTRIBUTE(S)
-            struct['S'] should be a list of select attributes,
-            set to an empty list when no select attributes are provided
-            '''
-            if line.startswith("SELECT ATTRIBUTE"):
-                if lines[curr_idx + 1].startswith("NUMBER OF "):
-                    struct['S'] = []
-                    curr_idx += 1
-                    continue
-                s_list = lines[curr_idx + 1].strip()
-                if len(s_list) == 0:
-                    struct['S'] = []
-                else:
-                    struct['S'] = [s.strip() for s in s_list.split(',')]
-                curr_idx += 2
-                continue 
-            '''
-            NUMBER OF GROUPING VARIABLES(n)
-            struct['n'] should be an integer,
-            set to 0 when there is no input
-            '''
-            if line.startswith("NUMBER OF GROUPING"):
-                if lines[curr_idx + 1].startswith("GROUPING ATTRIB"):
-                    struct['n'] = '0'
-                    curr_idx += 1
-                    continue
-                n =  lines[curr_idx + 1].strip()
-                if len(n) == 0:
-                    struct['n'] = '0'
-                else:
-                    struct['n'] = n
-                curr_idx += 2
-                continue
-            '''
-            GROUPING ATTRIBUTES(V)
-            struct['V'] should be a list of grouping attributes, 
-            set to an empty list when no grouping attribures are provided
-            '''
-            if line.startswith("GROUPING ATTRIBUTES"):
-                if lines[curr_idx + 1].startswith("F-VECT"):
-                    struct['V'] = []
-                    curr_idx += 1
-                    continue
-                v_list = lines[curr_idx + 1].strip()
-                if len(v_list) == 0:
-                    struct['V'] = []
-                else:
-                    struct['V'] = [v.strip() for v in v_list.split(',')]
-                curr_idx += 2
-                continue
-            '''
-            F-VECT([F])
-            struct['F'] should be a list of aggregate functions,
-            set to an empty list when no aggregate functions are provided
-            '''
-            if line.startswith("F-VECT"):
-                if lines[curr_idx + 1].startswith("SELECT CONDITION"):
-                    struct['F'] = []
-                    curr_idx += 1
-                    continue
-                f_list = lines[curr_idx + 1].strip()
-                if len(f_list) == 0:
-                    struct['F'] = []
-                else:
-                    struct['F'] = [f.strip() for f in f_list.split(',')]
-                curr_idx += 2
-                continue
-            '''
-            SELECT CONDITION-VECT([σ])
-            struct["sigma"] should be a list of all of the conditions,
-            set to an empty list when there are no condition provided
-            '''
-            if line.startswith("SELECT CONDITION"):
-                if lines[curr_idx + 1].startswith("HAVING"):
-                    curr_idx += 1
-                    struct['sigma'] = []
-                    continue
-                curr_idx += 1
-                conditions = []
-                while not lines[curr_idx].startswith("HAVING"):
-                    conditions.append(lines[curr_idx].strip())
-                    curr_idx += 1
-                struct['sigma'] = conditions
-                continue
-            '''
-            HAVING_CONDITION(G)
-            struct['G'] should be a list with 1 string having clause,
-            set to an empty list when therte is no having clause provided
-            '''
-            if line.startswith("HAVING"):
-                if curr_idx + 1 == len(lines):
-                    struct['G'] = []
-                    break
-                struct['G'] = [lines[curr_idx + 1].strip()]
-                break
-        return struct
+            text = f.read()
+        try:
+            return parse_query(text)
+        except QuerySyntaxError as syntax_error:
+            print(syntax_error)
+            sys.exit(1)
     
     def process_mf_struct(self, columns, column_datatypes):
         '''checks the phi operator input to ensure proper computation'''
@@ -133,33 +64,21 @@ class PhiOperator:
         def check_agg(agg_list, exception):
             '''Function used to check if the aggregates are valid'''
             for agg in agg_list:
-                agg_split = agg.split('_')
-                if len(agg_split) == 2:
-                    if not (agg_split[0] in ['avg','min','max','sum'] 
-                        and agg_split[1] in columns
-                        and column_datatypes[agg_split[1]] in NUMERICAL_OIDs
-                        or
-                        agg_split[0] == 'count' 
-                        and agg_split[1] in columns
-                    ):
-                        raise exception
-                elif len(agg_split) == 3:
-                    try:
-                        group = int(agg_split[0])
-                        n = self._mf_struct['n']
-                        if group > n or group < 1:
-                            raise exception
-                    except ValueError:
-                        raise exception
-                    if not (agg_split[1] in ['avg','min','max','sum'] 
-                        and agg_split[2] in columns
-                        and column_datatypes[agg_split[2]] in NUMERICAL_OIDs
-                        or
-                        agg_split[1] == 'count' 
-                        and agg_split[2] in columns
-                    ):
+                try:
+                    group, function, attribute = split_aggregate(agg)
+                except ValueError:
+                    raise exception
+                if group is not None:
+                    n = self._mf_struct['n']
+                    if group > n or group < 1:
                         raise exception
-                else:
+                if not ((function in NUMERICAL_AGGREGATES or percentile(function) is not None)
+                    and attribute in columns
+                    and column_datatypes[attribute] in NUMERICAL_OIDs
+                    or
+                    function in GENERAL_AGGREGATES 
+                    and attribute in columns
+                ):
                     raise exception
 
         try:
@@ -229,8 +148,8 @@ class PhiOperator:
             
             
             '''
-            For the having clause, check if all items in the clause are a math operation or a number.
-            If not, append to the aggregates list to be checked with the rest of the aggregates.
+            For the having clause, every attribute or aggregate in the parsed clause
+            is appended to the aggregates list to be checked with the rest of the aggregates.
             '''
 
             # to check if values in the HAVING CLAUSE are in the F-Vector
@@ -238,16 +157,8 @@ class PhiOperator:
 
             g = self._mf_struct['G']
             if len(g) != 0:
-                g_= g[0]
-                g_split = g_.split(' ')
-
-                ops = ['+','-','*','/','//','%', 'and', 'or', 'not', '(', ')','**', '>', '==', '=', '<', '<=', '>=']
-                for item in [item.strip() for item in g_split]:
-                    if item in ops:
-                        continue
-                    try:
-                        _ = float(item)
-                    except Exception:
+                for item in names(parse_expression(g[0], 'HAVING CLAUSE(G)')):
+                    if item not in g_aggregates:
                         g_aggregates.append(item)
 
 
@@ -260,7 +171,7 @@ class PhiOperator:
             f_aggregates = self._mf_struct['F']
 
             check_agg(s_aggregates, PhiInputError('SELECT ATTRIBUTE(S)', 'Select contains an invalid attribute or aggregate function'))
-            check_agg(g_aggregates, PhiInputError('HAVING CLAUSE(G)', 'Having clause contains an invalid varaible or aggregate function. Make sure gaving clause inputs have spaces between different entities'))
+            check_agg(g_aggregates, PhiInputError('HAVING CLAUSE(G)', 'Having clause contains an invalid variable or aggregate function'))
             check_agg(f_aggregates, PhiInputError('F-VECT([F])', 'F-Vector contains an invalid aggregate function'))
 
             f_aggregates_updated = False
@@ -287,80 +198,82 @@ class PhiOperator:
             new_sigma = []
 
             n = self._mf_struct['n']
-            n_list = [str(i) for i in range(1, n + 1)]
-            
+
+            def column_kind(name):
+                if name in columns:
+                    if column_datatypes[name] in NUMERICAL_OIDs:
+                        return 'number'
+                    if column_datatypes[name] in STRING_OID:
+                        return 'string'
+                    if column_datatypes[name] == DATE_OID:
+                        return 'date'
+                raise ValueError(f"{name} is not a column that conditions can use")
+
+            def normalize_date(text):
+                # accept any separators, e.g. 2018/01/05, and write the date as 'YYYY-MM-DD'
+                split_date = [part for part in re.split(r'\D+', text) if part]
+                if (len(split_date) == 3 and len(split_date[0]) == 4 and
+                        len(split_date[1]) == 2 and len(split_date[2]) == 2):
+                    year, month, day = [int(part) for part in split_date]
+                    if year >= 1 and month in range(1, 13) and day in range(1, calendar.monthrange(year, month)[1] + 1):
+                        return '-'.join(split_date)
+                raise ValueError(f"Invalid date {text}")
+
+            def check_condition(node):
+                '''Returns the condition with dates normalized and the kind of value it produces,
+                raises a ValueError when it refers to unknown columns or compares mismatched types'''
+                if isinstance(node, Literal):
+                    return node, 'string' if isinstance(node.value, str) else 'number'
+                if isinstance(node, Name):
+                    return node, column_kind(node.id)
+                if isinstance(node, UnaryOp):
+                    operand, kind = check_condition(node.operand)
+                    if kind != ('bool' if node.op == 'not' else 'number'):
+                        raise ValueError(f"Cannot apply {node.op} to a {kind}")
+                    return UnaryOp(node.op, operand), kind
+                if isinstance(node, BinOp):
+                    (left, left_kind), (right, right_kind) = check_condition(node.left), check_condition(node.right)
+                    if left_kind != 'number' or right_kind != 'number':
+                        raise ValueError(f"Arithmetic needs numbers, not a {left_kind} and a {right_kind}")
+                    return BinOp(node.op, left, right), 'number'
+                if isinstance(node, Compare):
+                    (left, left_kind), (right, right_kind) = check_condition(node.left), check_condition(node.right)
+                    # date literals are written as strings
+                    if left_kind == 'date' and right_kind == 'string' and isinstance(right, Literal):
+                        right, right_kind = Literal(normalize_date(right.value)), 'date'
+                    elif left_kind == 'string' and right_kind == 'date' and isinstance(left, Literal):
+                        left, left_kind = Literal(normalize_date(left.value)), 'date'
+                    if left_kind != right_kind or left_kind == 'bool':
+                        raise ValueError(f"Cannot compare a {left_kind} with a {right_kind}")
+                    return Compare(node.op, left, right), 'bool'
+                values = [check_condition(value) for value in node.values]
+                if any(kind != 'bool' for _, kind in values):
+                    raise ValueError(f"{node.op} needs conditions on both sides")
+                return BoolOp(node.op, [value for value, _ in values]), 'bool'
+
             for cond in sigma:
-                split_cond = cond.split(".")
-                if len(split_cond) == 2 and split_cond[0].strip() in n_list:
-                    if '<=' in split_cond[1]:
-                        operation = '<='
-                        cl = split_cond[1].split('<=')
-                    elif '>=' in split_cond[1]:
-                        operation = '>='
-                        cl = split_cond[1].split('>=')
-                    elif '=' in split_cond[1]:
-                        operation = '='
-                        cl = split_cond[1].split('=')
-                    elif '<' in split_cond[1]:
-                        operation = '<'
-                        cl = split_cond[1].split('<')
-                    elif '>' in split_cond[1]:
-                        operation = '>'
-                        cl = split_cond[1].split('>')
-                    if len(cl) == 2:
-                        if cl[0].strip() in columns:
-                            d_type = column_datatypes[cl[0].strip()]
-                            if d_type in NUMERICAL_OIDs:
-                                try:
-                                    _ = float(cl[1])
-                                    new_cond = split_cond[0].strip() + '.' + cl[0].strip() + operation + cl[1].strip()
-                                    new_sigma.append(cond)
-                                except Exception:
-                                    pass
-                            elif d_type in STRING_OID:
-                                comp = cl[1].strip()
-                                front_single = comp[0] == "'"
-                                back_single = comp[-1] == "'"
-                                front_double= comp[0] == '"'
-                                back_double = comp[-1] == '"'
-                                if front_single and back_single:     # 'xxx'
-                                    pass
-                                elif front_double and back_double:   # "xxx"
-                                    pass
-                                elif front_single and back_double:   # 'xxx"
-                                    comp = comp[:-1] + "'"
-                                elif front_double and back_single:   # 'xxx"
-                                    comp = + "'" + comp[1:]
-                                elif front_single:                   # 'xxx
-                                    comp += "'"
-                                elif front_double:                   # "xxx
-                                    comp += '"'
-                                elif back_single:                    # xxx'
-                                    comp = "'" + comp
-                                elif back_double:                    # xxx"
-                                    comp += "'"
-                                new_cond = split_cond[0].strip() + '.' + cl[0].strip() + operation + comp
-                                new_sigma.append(new_cond)
-                            elif d_type == DATE_OID:
-                                split_date = [part for part in re.split(r'\D+', cl[1]) if part]
-                                if (len(split_date) == 3 and len(split_date[0]) == 4 and 
-                                        len(split_date[1]) == 2 and len(split_date[2]) == 2):
-                                    year = int(split_date[0])
-                                    month = int(split_date[1])
-                                    day = int(split_date[2])
-                                    days_in_month = [calendar.monthrange(year, i)[1] for i in range(1, 13)]
-                                    print(days_in_month)
-                                    if month in range(1,13) and day in range(1, days_in_month[month-1] + 1):
-                                        date_format = "'" + split_date[0] + '-' + split_date[1] + '-' + split_date[2] + "'"
-                                        new_cond = split_cond[0].strip() + '.' + cl[0].strip() + operation + date_format
-                                        new_sigma.append(new_cond)
-            
+                try:
+                    try:
+                        group, node = parse_condition(cond)
+                    except QuerySyntaxError as syntax_error:
+                        # repair a string missing its closing quote, e.g. 4.state='PA
+                        if not syntax_error.message.startswith('Unterminated string'):
+                            raise
+                        cond = cond + cond[syntax_error.column - 1]
+                        group, node = parse_condition(cond)
+                    checked, kind = check_condition(node)
+                except (QuerySyntaxError, ValueError):
+                    continue
+                if group not in range(1, n + 1) or kind != 'bool':
+                    continue
+                new_sigma.append(cond if checked == node else f"{group}.{unparse(checked)}")
+
             if set(new_sigma) != set(sigma):
                 warnings.warn(ConditionsVectorWarning(new_sigma))
                 self._mf_struct['sigma'] = new_sigma
 
 
-        except PhiInputError as input_error:
+        except (PhiInputError, QuerySyntaxError) as input_error:
             print(input_error)
             sys.exit(1)
 
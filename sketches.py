@@ -0,0 +1,221 @@
+# I pledge my honor that I've abided by the Stevens Honor System
+# Steven DeFalco
+# Lucas Hope
+import math
+import hashlib
+import random
+from decimal import Decimal
+
+# z-score used for the 95% confidence intervals of approximate aggregates
+Z_95 = 1.96
+
+# above this sampling rate a sample saves too little work, so the query runs exactly
+MAX_SAMPLE_RATE = 0.5
+
+
+def sample_rate(error_target, group_rows, relative_variance=0):
+    """Returns the Bernoulli sampling rate needed so that the aggregates of a group with
+    group_rows rows have a relative 95% confidence interval of about error_target.
+
+    For a Bernoulli sample with rate p, a scaled count over m rows has relative standard error
+    sqrt((1 - p) / (p * m)), and a scaled sum is (1 + cv^2) times as variable, where cv^2 is the
+    relative variance of the summed values. Solving for p gives z^2 (1 + cv^2) / (e^2 * m + z^2 (1 + cv^2)).
+    """
+    if group_rows <= 0:
+        return 1.0
+    spread = Z_95 ** 2 * (1 + relative_variance)
+    rate = spread / (error_target ** 2 * group_rows + spread)
+    return min(1.0, rate)
+
+
+def relative_variance(values):
+    """Returns the squared coefficient of variation (variance / mean^2) of values, 0 when it is undefined"""
+    values = [float(value) for value in values if value is not None]
+    if len(values) < 2:
+        return 0
+    mean = sum(values) / len(values)
+    if mean == 0:
+        return 0
+    variance = sum((value - mean) ** 2 for value in values) / (len(values) - 1)
+    return variance / mean ** 2
+
+
+def bernoulli_mask(population, rate, seed=None):
+    """Returns a list of booleans marking which of the population rows are in the sample"""
+    if rate >= 1.0:
+        return [True] * population
+    rng = random.Random(seed)
+    return [rng.random() < rate for _ in range(population)]
+
+
+def hll_precision(error_target):
+    """Returns the HyperLogLog precision (log2 of the number of registers) needed for a relative
+    95% confidence interval of error_target, like sample_rate. The standard error is 1.04 / sqrt(m)."""
+    registers = (Z_95 * 1.04 / error_target) ** 2
+    return max(4, min(16, math.ceil(math.log2(registers))))
+
+
+class HyperLogLog:
+    """HyperLogLog sketch to estimate the number of distinct values in bounded memory"""
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+
+    def add(self, value):
+        digest = hashlib.blake2b(repr(value).encode(), digest_size=8).digest()
+        h = int.from_bytes(digest, 'big')
+        idx = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        # position of the leftmost 1 bit in the remaining bits
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other):
+        """Combines another sketch of the same precision into this one"""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches with different precisions")
+        for i in range(self.m):
+            if other.registers[i] > self.registers[i]:
+                self.registers[i] = other.registers[i]
+
+    def estimate(self):
+        m = self.m
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        elif m == 64:
+            alpha = 0.709
+        elif m == 32:
+            alpha = 0.697
+        else:
+            alpha = 0.673
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # small range correction with linear counting
+        if raw <= 2.5 * m and zeros != 0:
+            return m * math.log(m / zeros)
+        return raw
+
+    def standard_error(self):
+        return 1.04 / math.sqrt(self.m)
+
+    def __len__(self):
+        return round(self.estimate())
+
+
+class Moments:
+    """Running count, mean and variance using Welford's algorithm, mergeable with Chan's formula"""
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        # NUMERIC columns arrive as Decimal, which does not mix with the float state
+        value = float(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        """Combines the moments of another set of values into this one"""
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / total
+        self.count = total
+
+    def variance(self):
+        """Sample variance (like var in postgreSQL), 0 when there are fewer than 2 values"""
+        if self.count < 2:
+            return 0
+        return self.m2 / (self.count - 1)
+
+    def stddev(self):
+        return math.sqrt(self.variance())
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch in bounded memory (a KLL-style stack of compactors).
+
+    Each level holds at most k values, where a value at level i stands for 2^i input values.
+    When a level is full it is sorted and every other value is promoted to the next level,
+    so memory grows with k * log(n / k) instead of n.
+
+    Quantiles are exact (interpolated between the two nearest values, like percentile_cont in postgreSQL)
+    while fewer than k values are added. After that they are estimates: the smallest value whose
+    weighted rank reaches q, without interpolation, so a median is the lower of the two middle values.
+    """
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.count = 0
+        self.levels = [[]]
+        self.rng = random.Random(seed)
+
+    def add(self, value):
+        if isinstance(value, Decimal):
+            value = float(value)
+        self.count += 1
+        self.levels[0].append(value)
+        if len(self.levels[0]) >= self.k:
+            self.compress()
+
+    def merge(self, other):
+        """Combines another sketch into this one"""
+        self.count += other.count
+        for level, values in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append([])
+            self.levels[level].extend(values)
+        self.compress()
+
+    def compress(self):
+        level = 0
+        while level < len(self.levels):
+            values = self.levels[level]
+            if len(values) >= self.k:
+                values.sort()
+                # an odd value out stays at this level so no weight is lost
+                leftover = [values.pop()] if len(values) % 2 else []
+                # keep a random half, each kept value now weighs twice as much
+                offset = self.rng.randint(0, 1)
+                if level + 1 == len(self.levels):
+                    self.levels.append([])
+                self.levels[level + 1].extend(values[offset::2])
+                self.levels[level] = leftover
+            level += 1
+
+    def is_exact(self):
+        """True while no values have been compacted away"""
+        return len(self.levels) == 1
+
+    def quantile(self, q):
+        """Returns the value at quantile q (0 <= q <= 1), 0 when the sketch is empty"""
+        if self.is_exact():
+            values = sorted(self.levels[0])
+            if not values:
+                return 0
+            position = q * (len(values) - 1)
+            lower = math.floor(position)
+            fraction = position - lower
+            if fraction == 0:
+                return values[lower]
+            return values[lower] + (values[lower + 1] - values[lower]) * fraction
+        weighted = []
+        for level, values in enumerate(self.levels):
+            weighted.extend((value, 1 << level) for value in values)
+        if not weighted:
+            return 0
+        weighted.sort(key=lambda pair: pair[0])
+        total = sum(weight for _, weight in weighted)
+        target = q * total
+        seen = 0
+        for value, weight in weighted:
+            seen += weight
+            if seen >= target:
+                return value
+        return weighted[-1][0]
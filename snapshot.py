@@ -0,0 +1,131 @@
+# I pledge my honor that I've abided by the Stevens Honor System
+# Steven DeFalco
+# Lucas Hope
+import os
+import json
+import mmap
+import time
+import struct
+from collections.abc import Sequence
+
+'''
+Local snapshot of the sales table in a memory-mapped columnar file.
+
+Layout: the MAGIC bytes, the format VERSION and the length of a JSON metadata block (column names,
+datatype OIDs, string dictionaries, row count and where each column starts), then every column as a
+contiguous array of 8-byte values ('q' for integers, 'd' for floats), aligned to 8 bytes.
+Columns are read straight from the mapped pages, so processes reading the same snapshot share them.
+NUMERIC (Decimal) columns are not stored, since 'd' would silently round them to floats.
+'''
+
+MAGIC = b'SALESNAP'
+VERSION = 1
+HEADER = struct.Struct('<8sII')
+
+
+def column_typecode(values):
+    """Returns the array typecode to store a column with, or None if it cannot be stored"""
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        return 'q'
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+        return 'd'
+    return None
+
+
+def write_snapshot(path, rows, column_names, column_datatypes, dictionaries):
+    """Writes encoded rows (see connect.encode_rows) to path, returns False if a column cannot be stored"""
+    columns = [list(column) for column in zip(*rows)] if rows else [[] for _ in column_names]
+    typecodes = [column_typecode(column) for column in columns]
+    if None in typecodes:
+        return False
+
+    meta = {
+        'column_names': column_names,
+        'column_datatypes': column_datatypes,
+        'dictionaries': dictionaries,
+        'row_count': len(rows),
+        'columns': [],
+    }
+    # offsets depend on the metadata length, which depends on the offsets, so lay out columns relative to the data start
+    for i, name in enumerate(column_names):
+        meta['columns'].append({'name': name, 'typecode': typecodes[i], 'offset': i * len(rows) * 8})
+    meta_bytes = json.dumps(meta).encode()
+    data_start = HEADER.size + len(meta_bytes)
+    padding = -data_start % 8
+
+    # write to a temporary file and rename so readers never map a half-written snapshot
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(meta_bytes)))
+        f.write(meta_bytes)
+        f.write(b'\0' * padding)
+        for typecode, column in zip(typecodes, columns):
+            f.write(struct.pack(f'<{len(column)}{typecode}', *column))
+    os.replace(tmp_path, path)
+    return True
+
+
+class Snapshot:
+    """A mapped snapshot, columns are memoryviews over the file's pages"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, meta_length = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.mm.close()
+            raise ValueError(f"{path} is not a version {VERSION} sales snapshot")
+        meta = json.loads(self.mm[HEADER.size:HEADER.size + meta_length])
+        self.column_names = meta['column_names']
+        self.column_datatypes = meta['column_datatypes']
+        self.dictionaries = meta['dictionaries']
+        self.row_count = meta['row_count']
+
+        data_start = HEADER.size + meta_length
+        data_start += -data_start % 8
+        view = memoryview(self.mm)
+        self.columns = []
+        for column in meta['columns']:
+            start = data_start + column['offset']
+            self.columns.append(view[start:start + self.row_count * 8].cast(column['typecode']))
+
+    def age(self):
+        """Seconds since the snapshot was written or last confirmed fresh"""
+        return time.time() - os.path.getmtime(self.path)
+
+    def touch(self):
+        """Marks the snapshot as confirmed fresh"""
+        os.utime(self.path)
+
+    def rows(self):
+        return SnapshotRows(self.columns, self.row_count)
+
+
+class SnapshotRows(Sequence):
+    """The rows of a snapshot as a read-only sequence of tuples.
+
+    Nothing is copied up front: iterating zips the mapped columns, so each row tuple
+    is built from the file's pages only while it is being read.
+    """
+    def __init__(self, columns, row_count):
+        self.columns = columns
+        self.row_count = row_count
+
+    def __len__(self):
+        return self.row_count
+
+    def __iter__(self):
+        return zip(*self.columns)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.row_count))]
+        return tuple(column[index] for column in self.columns)
+
+
+def open_snapshot(path):
+    """Returns the Snapshot at path, or None when there is no usable snapshot"""
+    try:
+        return Snapshot(path)
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
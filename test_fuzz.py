@@ -0,0 +1,16 @@
+# I pledge my honor that I've abided by the Stevens Honor System
+# Steven DeFalco
+# Lucas Hope
+from benchmark import fuzz, fuzz_conditions
+
+'''
+The fuzzers from benchmark.py as tests, so that a parser crash on mutated input fails the build.
+'''
+
+
+def test_fuzz_queries():
+    assert fuzz(5000) == 0
+
+
+def test_fuzz_conditions():
+    assert fuzz_conditions(5000) == 0